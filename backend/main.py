@@ -1,21 +1,29 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-import PyPDF2
+from fastapi.responses import FileResponse, ORJSONResponse, Response
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import pikepdf
+from PIL import Image
+import blake3
+import zstandard
 import io
 import os
-from typing import List
+from typing import BinaryIO, List, Union
 import tempfile
 from datetime import datetime
 import shutil
-import subprocess
+import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
 app = FastAPI(
     title="PDF Utilities API",
     description="Professional PDF manipulation tools",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 # =====================
@@ -33,6 +41,7 @@ app.add_middleware(
         "X-Compressed-Size",
         "X-Reduction-Percentage",
         "X-Quality-Setting",
+        "ETag",
     ],
 )
 
@@ -43,54 +52,182 @@ FRONTEND_DIR = os.path.join(os.getcwd(), "frontend_build")
 if os.path.exists(FRONTEND_DIR):
     app.mount("/static", StaticFiles(directory=os.path.join(FRONTEND_DIR, "static")), name="static")
 
-
-@app.get("/")
-def serve_react():
-    index_path = os.path.join(FRONTEND_DIR, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path)
-    return {"message": "React build not found."}
+# The SPA shell only changes on redeploy, so read it once instead of per request
+INDEX_PATH = os.path.join(FRONTEND_DIR, "index.html")
+INDEX_HTML = None
+if os.path.isfile(INDEX_PATH):
+    with open(INDEX_PATH, "rb") as f:
+        INDEX_HTML = f.read()
 
 
 # =====================
 # 🔹 Temporary Storage
 # =====================
 TEMP_DIR = tempfile.gettempdir()
-UPLOAD_DIR = os.path.join(TEMP_DIR, "pdf_uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+SCRATCH_LIMIT = int(os.environ.get("PDF_SCRATCH_LIMIT", 512 * 1024 * 1024))
+
+
+SHM_DIR = "/dev/shm"
+SHM_MAX_INPUT = int(os.environ.get("PDF_SHM_MAX_INPUT", 32 * 1024 * 1024))
+
+
+def _default_upload_dir() -> str:
+    """Prefer tmpfs for short-lived PDFs, if it is big enough to hold SCRATCH_LIMIT"""
+    if os.path.isdir(SHM_DIR):
+        st = os.statvfs(SHM_DIR)
+        if st.f_frsize * st.f_blocks >= SCRATCH_LIMIT:
+            return os.path.join(SHM_DIR, "pdf_uploads")
+    return os.path.join(TEMP_DIR, "pdf_uploads")
+
+
+UPLOAD_DIR = os.environ.get("PDF_SCRATCH") or _default_upload_dir()
+# Inputs above SHM_MAX_INPUT are kept out of RAM-backed scratch
+LARGE_UPLOAD_DIR = os.path.join(TEMP_DIR, "pdf_uploads") if UPLOAD_DIR.startswith(SHM_DIR) else UPLOAD_DIR
+os.makedirs(LARGE_UPLOAD_DIR, exist_ok=True)
+# Compressed outputs keyed by input digest and level, shared by all workers
+COMPRESSED_DIR = os.path.join(UPLOAD_DIR, "compressed")
+os.makedirs(COMPRESSED_DIR, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+PDF_SNIFF_SIZE = 1024  # readers accept the header and %%EOF anywhere in the first/last 1 KiB
+
+
+def _copy_upload(src: BinaryIO, out: BinaryIO, hasher=None):
+    """Copy an upload's spool in fixed-size chunks; returns (bytes written, head, tail)"""
+    # Plain buffered I/O rather than io_uring: there is no stdlib binding, and
+    # a few large writes per upload, already off the loop, leave little to batch
+    written = 0
+    head = tail = b""
+    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+        out.write(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+        if not written:
+            head = chunk[:PDF_SNIFF_SIZE]
+        tail = (tail + chunk[-PDF_SNIFF_SIZE:])[-PDF_SNIFF_SIZE:]
+        written += len(chunk)
+    out.flush()
+    return written, head, tail
+
+
+async def spool_to_disk(upload: UploadFile, out: BinaryIO, hasher=None) -> int:
+    """
+    Stream an upload to an open file in fixed-size chunks, returning bytes written.
+    Rejects uploads without a PDF header and trailer, checked as the chunks stream past.
+    """
+    # One threadpool hop for the whole copy, rather than one per chunk read,
+    # keeps the disk writes and hashing off the event loop as well
+    await upload.seek(0)
+    written, head, tail = await run_in_threadpool(_copy_upload, upload.file, out, hasher)
+    _require_pdf(upload, head, tail)
+    return written
+
+
+def _require_pdf(upload: UploadFile, head: bytes, tail: bytes):
+    """Reject an upload whose first/last bytes lack a PDF header and trailer"""
+    if b"%PDF-" not in head or b"%%EOF" not in tail:
+        raise HTTPException(status_code=400, detail=f"{upload.filename} is not a valid PDF")
+
+
+def _sniff_uploads(uploads: List[UploadFile]) -> List[int]:
+    """Check uploads look like PDFs by reading only their ends; returns their sizes (blocking)"""
+    sizes = []
+    for upload in uploads:
+        src = upload.file
+        size = src.seek(0, os.SEEK_END)
+        src.seek(0)
+        head = src.read(PDF_SNIFF_SIZE)
+        src.seek(max(0, size - PDF_SNIFF_SIZE))
+        _require_pdf(upload, head, src.read(PDF_SNIFF_SIZE))
+        sizes.append(size)
+    return sizes
+
+
+def remove_quietly(path: str):
+    """Delete a temp file, ignoring one that is already gone"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class PDFFileResponse(FileResponse):
+    """FileResponse sent in 1 MiB chunks instead of 64 KiB"""
+    # Neither Starlette nor uvicorn does sendfile, so each chunk is a threadpool
+    # read plus a socket write; larger chunks cut those round trips 16-fold
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+
+CLEANUP_INTERVAL = 300  # seconds
+CLEANUP_WORKERS = 8  # unlinks in one directory share its lock, so more threads don't help
+
+
+def _remove_logged(path: str):
+    """Delete one file for cleanup, reporting anything but a file already gone"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Cleanup error: {e}")
 
 
 def cleanup_old_files():
-    """Remove old temporary files (>1 hour old)"""
+    """Remove old temporary and cached files (>1 hour old), then the oldest cache entries beyond SCRATCH_LIMIT"""
     now = datetime.now().timestamp()
-    for filename in os.listdir(UPLOAD_DIR):
-        file_path = os.path.join(UPLOAD_DIR, filename)
+    stale, cached = [], []
+    total = 0
+    # scandir yields the file type for free and stat() is cached per entry
+    for directory in dict.fromkeys((UPLOAD_DIR, COMPRESSED_DIR, LARGE_UPLOAD_DIR)):
+        # Large inputs live on another filesystem; they don't use up the scratch budget
+        on_scratch = directory != LARGE_UPLOAD_DIR or LARGE_UPLOAD_DIR == UPLOAD_DIR
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        if now - st.st_mtime > 3600:  # older than 1 hour
+                            stale.append(entry.path)
+                        elif on_scratch:
+                            total += st.st_size
+                            if directory == COMPRESSED_DIR:
+                                cached.append((st.st_mtime, st.st_size, entry.path))
+                except Exception as e:
+                    print(f"Cleanup error: {e}")
+
+    # Keep scratch space bounded (it may be RAM-backed tmpfs). Only cache entries
+    # are evicted for space: younger scratch files belong to requests in flight
+    for _, size, file_path in sorted(cached):
+        if total <= SCRATCH_LIMIT:
+            break
+        stale.append(file_path)
+        total -= size
+
+    # Unlinks are independent, so overlap them rather than paying each in turn
+    if len(stale) > 1:
+        with ThreadPoolExecutor(max_workers=min(CLEANUP_WORKERS, len(stale))) as pool:
+            pool.map(_remove_logged, stale)
+    elif stale:
+        _remove_logged(stale[0])
+
+
+async def _cleanup_loop():
+    """Run cleanup_old_files off the event loop every CLEANUP_INTERVAL seconds"""
+    while True:
         try:
-            if os.path.isfile(file_path):
-                file_age = now - os.path.getmtime(file_path)
-                if file_age > 3600:  # older than 1 hour
-                    os.remove(file_path)
+            await asyncio.to_thread(cleanup_old_files)
         except Exception as e:
             print(f"Cleanup error: {e}")
+        await asyncio.sleep(CLEANUP_INTERVAL)
 
 
 @app.on_event("startup")
 async def startup_event():
-    cleanup_old_files()
+    app.state.cleanup_task = asyncio.create_task(_cleanup_loop())
 
 
-# =====================
-# 🔹 Serve Frontend (SPA fallback)
-# =====================
-@app.get("/{full_path:path}")
-async def serve_frontend(full_path: str):
-    index_path = os.path.join(FRONTEND_DIR, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path)
-    return {
-        "message": "Frontend build not found. Please ensure `npm run build` has been executed.",
-        "status": "backend-only mode",
-    }
+@app.on_event("shutdown")
+async def stop_cleanup():
+    app.state.cleanup_task.cancel()
 
 
 # =====================
@@ -104,114 +241,382 @@ def health_check():
 # =====================
 # 🔹 PDF MERGE
 # =====================
+# Bounded so PDF work doesn't oversubscribe the cores Ghostscript also uses
+PDF_EXECUTOR = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="pdf")
+SMALL_MERGE_LIMIT = 256 * 1024  # merges below this are built in memory
+
+
+def _outline_dest(pdf: pikepdf.Pdf, item: pikepdf.OutlineItem):
+    """Explicit destination array a bookmark points at, or None if it doesn't point at a page"""
+    dest = item.destination
+    if dest is None and item.action is not None and item.action.get("/S") == pikepdf.Name.GoTo:
+        dest = item.action.get("/D")
+    if isinstance(dest, (str, pikepdf.String, pikepdf.Name)):
+        # Named destination: look it up in the name tree, or the old-style /Dests dict
+        names = pdf.Root.get("/Names")
+        if names is not None and "/Dests" in names:
+            dest = pikepdf.NameTree(names.Dests).get(str(dest))
+        elif "/Dests" in pdf.Root:
+            dest = pdf.Root.Dests.get(str(dest))
+        if isinstance(dest, pikepdf.Dictionary):
+            dest = dest.get("/D")
+    if isinstance(dest, pikepdf.Array) and len(dest) and isinstance(dest[0], pikepdf.Dictionary):
+        return dest
+    return None
+
+
+def _rebase_outline(merged: pikepdf.Pdf, pdf: pikepdf.Pdf, items: list, page_index: dict, offset: int) -> list:
+    """Copy bookmarks from pdf into merged, pointing them at their pages' positions in the merged file"""
+    copies = []
+    for item in items:
+        # Colour and style live on the item's own dictionary
+        obj = merged.make_indirect(pikepdf.Dictionary())
+        if "/C" in item.obj:
+            obj.C = pikepdf.Array([float(v) for v in item.obj.C])
+        if "/F" in item.obj:
+            obj.F = int(item.obj.F)
+        dest = _outline_dest(pdf, item)
+        page = None if dest is None else page_index.get(dest[0].objgen)
+        if page is not None:
+            # Same view (/XYZ, /FitH, ...) on the page's copy in the merged file
+            target = pikepdf.Array([merged.pages[page + offset].obj, *list(dest)[1:]])
+            copy = pikepdf.OutlineItem(item.title, target, obj=obj)
+        elif item.action is not None and item.action.get("/S") != pikepdf.Name.GoTo:
+            # URI, launch and other actions carry over unchanged
+            action = merged.copy_foreign(pdf.make_indirect(item.action))
+            copy = pikepdf.OutlineItem(item.title, action=action, obj=obj)
+        else:
+            copy = pikepdf.OutlineItem(item.title, obj=obj)
+        copy.is_closed = item.is_closed
+        copy.children.extend(_rebase_outline(merged, pdf, item.children, page_index, offset))
+        copies.append(copy)
+    return copies
+
+
+def _do_merge(sources: List[BinaryIO], output: Union[str, io.BytesIO]):
+    """Merge the open PDF files in sources into output (blocking, run on PDF_EXECUTOR)"""
+    # Sources must stay open until the merged file is saved
+    with ExitStack() as stack:
+        merged = stack.enter_context(pikepdf.Pdf.new())
+        bookmarks = []
+        for source in sources:
+            source.seek(0)
+            pdf = stack.enter_context(pikepdf.open(source))
+            offset = len(merged.pages)
+            merged.pages.extend(pdf.pages)
+            # Each input's bookmarks are kept, shifted to where its pages land
+            page_index = {page.objgen: i for i, page in enumerate(pdf.pages)}
+            with pdf.open_outline() as outline:
+                bookmarks.extend(_rebase_outline(merged, pdf, outline.root, page_index, offset))
+        if bookmarks:
+            with merged.open_outline() as outline:
+                outline.root.extend(bookmarks)
+        # Linearized so the frontend can show page 1 before the download completes;
+        # object streams pack the many small page objects of a merge compactly
+        merged.save(output, linearize=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+
+
 @app.post("/api/pdf/merge")
 async def merge_pdfs(files: List[UploadFile] = File(...)):
     if len(files) < 2:
         raise HTTPException(status_code=400, detail="At least 2 PDF files are required")
 
-    output_filename = f"merged_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    output_path = os.path.join(UPLOAD_DIR, output_filename)
-    merger = PyPDF2.PdfMerger()
+    now = datetime.now()
+    output_filename = f"merged_{now.strftime('%Y%m%d_%H%M%S')}.pdf"
+    # The download name is per second; the scratch path must be unique per request
+    output_path = os.path.join(UPLOAD_DIR, f"merged_{now.strftime('%Y%m%d_%H%M%S_%f')}.pdf")
 
-    temp_files = []
+    for f in files:
+        if not f.filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail=f"{f.filename} is not a PDF")
+
+    # pikepdf reads the upload spools in place (memory or Starlette's temp
+    # file), so nothing is copied to scratch before merging
+    input_sizes = await run_in_threadpool(_sniff_uploads, files)
+    # Small merges are sent straight from memory, skipping the output
+    # file and its create/unlink altogether
+    in_memory = sum(input_sizes) < SMALL_MERGE_LIMIT
+    output = io.BytesIO() if in_memory else output_path
     try:
-        for f in files:
-            if not f.filename.lower().endswith(".pdf"):
-                raise HTTPException(status_code=400, detail=f"{f.filename} is not a PDF")
-            content = await f.read()
-            temp_file = io.BytesIO(content)
-            merger.append(temp_file)
-            temp_files.append(temp_file)
-        with open(output_path, "wb") as out:
-            merger.write(out)
-    finally:
-        merger.close()
-        for tf in temp_files:
-            tf.close()
+        await asyncio.get_running_loop().run_in_executor(
+            PDF_EXECUTOR, _do_merge, [f.file for f in files], output
+        )
+    except BaseException as e:
+        # A failed save can leave a partial output file behind
+        if not in_memory:
+            await asyncio.to_thread(remove_quietly, output_path)
+        if isinstance(e, pikepdf.PdfError):
+            raise HTTPException(status_code=400, detail=f"Could not merge PDFs: {e}")
+        raise
 
-    return FileResponse(output_path, media_type="application/pdf", filename=output_filename)
+    if in_memory:
+        return Response(
+            output.getvalue(),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{output_filename}"'},
+        )
+    return PDFFileResponse(
+        output_path,
+        stat_result=await asyncio.to_thread(os.stat, output_path),
+        media_type="application/pdf",
+        filename=output_filename,
+        background=BackgroundTask(remove_quietly, output_path),
+    )
 
 
 # =====================
-# 🔹 PDF COMPRESS (ULTRA-RELIABLE VERSION)
+# 🔹 Persistent Ghostscript Workers
 # =====================
-@app.post("/api/pdf/compress")
-async def compress_pdf(file: UploadFile = File(...), level: int = 0):
+GS_PERSISTENT = os.environ.get("GS_PERSISTENT", "0") == "1"
+GS_JOB_DONE = b"%%GS_JOB_DONE"
+GS_POOLS = {}
+# Server worker processes. Each has its own semaphores, so the per-process
+# limits below default to that worker's share of the cores. Only a configured
+# count is trusted: __main__ and the Dockerfile set WEB_CONCURRENCY, and a
+# bare `uvicorn main:app` runs a single worker
+WEB_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+CPU_SHARE = max(1, (os.cpu_count() or 1) // WEB_WORKERS)
+# Caps running gs processes in this worker however jobs and shards combine; at
+# least one per worker, so with more workers than cores the host is oversubscribed
+GS_SEM = asyncio.Semaphore(int(os.environ.get("MAX_GS_PROCS", CPU_SHARE)))
+
+
+# Uploads and outputs only ever live in the scratch directories, so SAFER
+# workers may read and write there (and the null output) and nowhere else
+GS_WORKER_PERMITS = [
+    *(f"--permit-file-read={os.path.join(d, '*')}" for d in dict.fromkeys((UPLOAD_DIR, LARGE_UPLOAD_DIR))),
+    *(f"--permit-file-write={os.path.join(d, '*')}" for d in dict.fromkeys((UPLOAD_DIR, LARGE_UPLOAD_DIR))),
+    f"--permit-file-write={os.devnull}",
+]
+
+
+def _ps_string(value: str) -> str:
+    """Quote a path as a PostScript string literal"""
+    return "(" + value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+class GhostscriptWorker:
     """
-    Compress PDF using Ghostscript with fallback methods.
-    Valid levels:
-        0: /screen     → Maximum compression (72 DPI)
-        1: /ebook      → Balanced compression (150 DPI)
-        2: /printer    → High quality (300 DPI)
-        3: /prepress   → Highest quality (300+ DPI)
+    A long-lived Ghostscript interpreter that runs compression jobs fed on stdin.
+
+    Each job points pdfwrite at a new OutputFile, feeds the input to the PDF
+    interpreter (runpdf, so an upload is never executed as PostScript), then
+    switches back to the null output so pdfwrite finishes the file. Workers
+    keep -dSAFER, with file access limited to the scratch directories.
+    A worker runs one job at a time; GSPool hands out exclusive access.
     """
-    if not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="File must be a PDF")
 
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    input_path = os.path.join(UPLOAD_DIR, f"input_{timestamp}.pdf")
-    output_path = os.path.join(UPLOAD_DIR, f"compressed_{timestamp}.pdf")
-    fallback_path = os.path.join(UPLOAD_DIR, f"fallback_{timestamp}.pdf")
-
-    # Save uploaded file
-    content = await file.read()
-    with open(input_path, "wb") as f:
-        f.write(content)
-
-    # Map level to parameters
-    quality_settings = {
-        0: {
-            "preset": "/screen",
-            "color_res": 72,
-            "gray_res": 72,
-            "mono_res": 72,
-            "jpeg_q": 10,
-            "downsample": True
-        },
-        1: {
-            "preset": "/ebook",
-            "color_res": 150,
-            "gray_res": 150,
-            "mono_res": 150,
-            "jpeg_q": 50,
-            "downsample": True
-        },
-        2: {
-            "preset": "/printer",
-            "color_res": 300,
-            "gray_res": 300,
-            "mono_res": 300,
-            "jpeg_q": 75,
-            "downsample": False
-        },
-        3: {
-            "preset": "/prepress",
-            "color_res": 300,
-            "gray_res": 300,
-            "mono_res": 300,
-            "jpeg_q": 90,
-            "downsample": False
-        }
-    }
+    def __init__(self, args: List[str]):
+        self.args = args
+        self.proc = None
 
-    if level not in quality_settings:
-        raise HTTPException(status_code=400, detail="Compression level must be 0, 1, 2, or 3")
+    async def _start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.args,
+            "-dSAFER",
+            *GS_WORKER_PERMITS,
+            f"-sOutputFile={os.devnull}",
+            "-",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
 
-    settings = quality_settings[level]
+    async def _wait_done(self) -> bool:
+        while line := await self.proc.stdout.readline():
+            if line.startswith(GS_JOB_DONE):
+                return line[len(GS_JOB_DONE):].strip() == b"OK"
+        return False  # interpreter exited mid-job
 
-    # Locate Ghostscript binary
-    gs = shutil.which("gs") or shutil.which("gswin32c") or shutil.which("gswin64c")
-    if not gs:
-        raise HTTPException(
-            status_code=500,
-            detail="Ghostscript not found. Please install Ghostscript and add it to your system PATH."
+    async def run(self, input_path: str, output_path: str, timeout: float = 60) -> bool:
+        """Compress input_path into output_path, returning False on any failure"""
+        src, out, null = _ps_string(input_path), _ps_string(output_path), _ps_string(os.devnull)
+        job = (
+            f"mark {{ << /OutputFile {out} >> setpagedevice {src} (r) file runpdf }} stopped "
+            f"{{ << /OutputFile {null} >> setpagedevice }} stopped or "
+            f"{{ (ERR) }} {{ (OK) }} ifelse ({GS_JOB_DONE.decode()} ) print = flush cleartomark\n"
         )
+        try:
+            if self.proc is None or self.proc.returncode is not None:
+                await self._start()
+            self.proc.stdin.write(job.encode())
+            await self.proc.stdin.drain()
+            if await asyncio.wait_for(self._wait_done(), timeout):
+                return True
+            print("Persistent Ghostscript job failed, restarting worker")
+        except Exception as e:
+            print(f"Persistent Ghostscript worker error: {e}")
+        # Interpreter state is unknown after a failure; start fresh next time
+        await self.close()
+        return False
+
+    async def close(self):
+        if self.proc is None:
+            return
+        proc, self.proc = self.proc, None
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+class GSPool:
+    """Idle GhostscriptWorkers for one argument set, handed out through an asyncio.Queue"""
+
+    def __init__(self, args: List[str], size: int):
+        self.workers = [GhostscriptWorker(args) for _ in range(size)]
+        self.idle = asyncio.Queue()
+        for worker in self.workers:
+            self.idle.put_nowait(worker)  # interpreters start on their first job
+
+    async def run(self, input_path: str, output_path: str) -> bool:
+        worker = await self.idle.get()
+        try:
+            async with GS_SEM:
+                return await worker.run(input_path, output_path)
+        finally:
+            self.idle.put_nowait(worker)
+
+    async def close(self):
+        for worker in self.workers:
+            await worker.close()
+
+
+def _gs_pool(key: tuple, args: List[str]) -> GSPool:
+    """Return the persistent worker pool for an argument set, creating it lazily"""
+    pool = GS_POOLS.get(key)
+    if pool is None:
+        # COMPRESS_SEM admits at most MAX_COMPRESS jobs, so more workers would sit idle
+        pool = GS_POOLS[key] = GSPool(args, MAX_COMPRESS)
+    return pool
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for pool in GS_POOLS.values():
+        await pool.close()
+
+
+# =====================
+# 🔹 PDF COMPRESS (ULTRA-RELIABLE VERSION)
+# =====================
+# Each gs job pins a core and can take hundreds of MB; excess requests queue
+# here. Like GS_SEM it is per worker: half its share of the cores, which is
+# cpu_count // 2 for a single worker (the Dockerfile default)
+MAX_COMPRESS = int(os.environ.get("MAX_COMPRESS", max(1, CPU_SHARE // 2)))
+COMPRESS_SEM = asyncio.Semaphore(MAX_COMPRESS)
+# Opt-in: long documents can be split into page ranges compressed in parallel.
+# Shards per job are capped so concurrent jobs stay within this worker's share
+# of cores, so setting GS_SHARD_PAGES only has an effect when that share exceeds
+# MAX_COMPRESS (e.g. a single worker on a 4+ core host)
+GS_SHARD_PAGES = int(os.environ.get("GS_SHARD_PAGES", 0))  # minimum pages per shard, 0 disables
+GS_MAX_SHARDS = max(1, CPU_SHARE // MAX_COMPRESS)
+# Below this share of image bytes there is little for gs to gain, so it is skipped
+GS_MIN_IMAGE_SHARE = float(os.environ.get("GS_MIN_IMAGE_SHARE", 0.2))  # 0 always uses gs
+# Duplicate detection hashes every image; past this many (scans) it costs far more than it saves
+GS_DEDUP_MAX_IMAGES = 100
+# Compressed PDFs rarely pack much further, so only keep the zstd form when it pays
+CACHE_ZSTD_MIN_SAVING = 0.1
+
+
+def _cache_lookup(cache_path: str, output_path: str):
+    """Find a cached output and mark it recently used; returns (path to serve, stat) or None"""
+    try:
+        os.utime(cache_path)  # recently used entries outlive cleanup
+        st = os.stat(cache_path)
+        return (cache_path, st) if st.st_size else None
+    except OSError:
+        pass
+    # A zstd-packed entry is unpacked into this request's own output file
+    packed_path = cache_path + ".zst"
+    try:
+        os.utime(packed_path)
+        with open(packed_path, "rb") as src, open(output_path, "wb") as dst:
+            zstandard.ZstdDecompressor().copy_stream(src, dst)
+        return output_path, os.stat(output_path)
+    except (OSError, zstandard.ZstdError):
+        remove_quietly(output_path)
+        return None
+
+
+def _cache_output(path: str, cache_path: str):
+    """Publish a sent output to the cache, zstd-packed if that saves enough, then remove it"""
+    packed_path = path + ".zst"
+    try:
+        with open(path, "rb") as src, open(packed_path, "wb") as dst:
+            size, packed_size = zstandard.ZstdCompressor(level=3).copy_stream(src, dst)
+        if packed_size <= size * (1 - CACHE_ZSTD_MIN_SAVING):
+            os.replace(packed_path, cache_path + ".zst")
+        else:
+            # Plain entries are hard links, so the first writer wins and they never change
+            os.link(path, cache_path)
+    except OSError:
+        pass  # already cached by a concurrent request, or no hard links on this filesystem
+    finally:
+        remove_quietly(packed_path)
+        remove_quietly(path)
+
+
+def _output_stat(path: str):
+    """Stat of a compression output, or None if nothing was produced"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st if st.st_size else None
+
 
-    # Build primary Ghostscript command with explicit parameters
-    cmd = [
-        gs,
+def _reuse_input(input_path: str, output_path: str) -> os.stat_result:
+    """Serve the upload itself as the output, for when compressing didn't shrink it"""
+    os.replace(input_path, output_path)  # both live in the same input_dir, so a rename
+    return os.stat(output_path)
+
+
+# Map compression level to Ghostscript parameters
+QUALITY_SETTINGS = {
+    0: {
+        "preset": "/screen",
+        "color_res": 72,
+        "gray_res": 72,
+        "mono_res": 72,
+        "jpeg_q": 10,
+        "downsample": True
+    },
+    1: {
+        "preset": "/ebook",
+        "color_res": 150,
+        "gray_res": 150,
+        "mono_res": 150,
+        "jpeg_q": 50,
+        "downsample": True
+    },
+    2: {
+        "preset": "/printer",
+        "color_res": 300,
+        "gray_res": 300,
+        "mono_res": 300,
+        "jpeg_q": 75,
+        "downsample": False
+    },
+    3: {
+        "preset": "/prepress",
+        "color_res": 300,
+        "gray_res": 300,
+        "mono_res": 300,
+        "jpeg_q": 90,
+        "downsample": False
+    }
+}
+
+
+def _build_gs_args(settings: dict, detect_duplicates: bool, compatibility: str = "1.7") -> tuple:
+    """Ghostscript flags for one level (everything but binary, output and input)"""
+    # Explicit parameters rather than relying on the preset alone.
+    # pdfwrite never rasterizes pages, so the banding knobs
+    # (-dNumRenderingThreads, -dBufferSpace, -dMaxBitmap) do nothing here:
+    # each job uses one core, and throughput comes from running jobs in parallel.
+    args = [
         "-sDEVICE=pdfwrite",
-        "-dCompatibilityLevel=1.7",
+        f"-dCompatibilityLevel={compatibility}",
         f"-dPDFSETTINGS={settings['preset']}",
         "-dNOPAUSE",
         "-dQUIET",
@@ -219,7 +624,7 @@ async def compress_pdf(file: UploadFile = File(...), level: int = 0):
         "-dEmbedAllFonts=true",
         "-dSubsetFonts=true",
         "-dAutoRotatePages=/None",
-        "-dDetectDuplicateImages=true",
+        f"-dDetectDuplicateImages={str(detect_duplicates).lower()}",
         "-dCompressFonts=true",
         "-dCompressPages=true",
         "-dUseFlateCompression=true",
@@ -227,13 +632,11 @@ async def compress_pdf(file: UploadFile = File(...), level: int = 0):
         f"-dGrayImageResolution={settings['gray_res']}",
         f"-dMonoImageResolution={settings['mono_res']}",
         f"-dJPEGQ={settings['jpeg_q']}",
-        f"-sOutputFile={output_path}",
-        input_path,
     ]
 
-    # Add downsample flags if needed
+    # Add downsample flags if needed (before the input file, or gs ignores them)
     if settings['downsample']:
-        cmd.extend([
+        args.extend([
             "-dDownsampleColorImages=true",
             "-dDownsampleGrayImages=true",
             "-dDownsampleMonoImages=true",
@@ -242,151 +645,372 @@ async def compress_pdf(file: UploadFile = File(...), level: int = 0):
             "-dMonoImageFilter=/CCITTFaxEncode",
         ])
 
-    # Try primary compression
+    return tuple(args)
+
+
+# Built once at import; requests only add the binary, output and input paths
+GS_ARGS = {
+    (level, detect_duplicates): _build_gs_args(settings, detect_duplicates)
+    for level, settings in QUALITY_SETTINGS.items()
+    for detect_duplicates in (True, False)
+}
+# Fallback when the primary pass fails: maximum compression, as PDF 1.4
+GS_FALLBACK_ARGS = {
+    detect_duplicates: _build_gs_args(QUALITY_SETTINGS[0], detect_duplicates, compatibility="1.4")
+    for detect_duplicates in (True, False)
+}
+
+
+async def _run_gs(cmd: list, timeout: int = 60) -> tuple:
+    """Run one Ghostscript command without blocking the event loop; returns (returncode, stderr)"""
+    async with GS_SEM:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except OSError as e:
+            return -1, str(e)
+        try:
+            _, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return -1, f"Ghostscript timed out after {timeout}s"
+    return proc.returncode, stderr.decode("utf-8", errors="ignore")
+
+
+def _image_stats(path: str) -> tuple:
+    """Count and encoded size of image XObjects, from stream lengths alone (blocking, run on PDF_EXECUTOR)"""
+    count = size = 0
+    with pikepdf.open(path) as pdf:
+        for obj in pdf.objects:
+            if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == pikepdf.Name.Image:
+                count += 1
+                size += int(obj.get("/Length", 0))
+    return count, size
+
+
+async def _probe_for_ghostscript(input_path: str, orig_size: int) -> tuple:
+    """(whether a gs rewrite pays off, whether gs should look for duplicate images)"""
+    try:
+        count, image_bytes = await asyncio.get_running_loop().run_in_executor(PDF_EXECUTOR, _image_stats, input_path)
+    except pikepdf.PdfError:
+        return True, True  # let Ghostscript have a go at it
+    worth_it = GS_MIN_IMAGE_SHARE <= 0 or orig_size <= 0 or image_bytes / orig_size >= GS_MIN_IMAGE_SHARE
+    return worth_it, count < GS_DEDUP_MAX_IMAGES
+
+
+def _page_count(path: str) -> int:
+    """Number of pages in a PDF (blocking, run on PDF_EXECUTOR)"""
+    with pikepdf.open(path) as pdf:
+        return len(pdf.pages)
+
+
+# Page entries taken from the compressed shards; everything else, including
+# /Annots and the document catalog, stays as it was in the original
+SHARD_PAGE_KEYS = ("/Contents", "/Resources", "/MediaBox", "/CropBox", "/BleedBox",
+                   "/TrimBox", "/ArtBox", "/Rotate", "/UserUnit", "/Group")
+
+
+def _join_shards(input_path: str, parts: List[str], output: str):
+    """Swap the compressed shard pages into the original document (blocking, run on PDF_EXECUTOR)
+
+    Rebuilding from the original keeps outlines, forms, named destinations,
+    page labels and metadata, which a plain page concatenation would drop.
+    """
+    with pikepdf.open(input_path) as pdf, ExitStack() as stack:
+        shard_pages = []
+        for part in parts:
+            shard = stack.enter_context(pikepdf.open(part))
+            for page in shard.pages:
+                # Copy only the page's content entries, not its /Parent page tree
+                entries = shard.make_indirect(pikepdf.Dictionary({
+                    key: page.obj[key] for key in SHARD_PAGE_KEYS if key in page.obj
+                }))
+                shard_pages.append(pdf.copy_foreign(entries))
+        if len(shard_pages) != len(pdf.pages):
+            raise pikepdf.PdfError(f"expected {len(pdf.pages)} pages, got {len(shard_pages)}")
+        for page, entries in zip(pdf.pages, shard_pages):
+            for key in SHARD_PAGE_KEYS:
+                if key in entries:
+                    page.obj[key] = entries[key]
+                elif key in page.obj:
+                    del page.obj[key]
+            # Pinned so values inherited from the original page tree can't apply
+            page.obj.Rotate = entries.get("/Rotate", 0)
+            page.obj.CropBox = entries.get("/CropBox", entries.MediaBox)
+        pdf.save(output, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+
+
+async def _run_gs_sharded(gs_args: list, input_path: str, output_path: str) -> tuple:
+    """Primary pass, split across page ranges run in parallel when the document is long enough"""
+    loop = asyncio.get_running_loop()
+    pages = 0
+    if GS_SHARD_PAGES > 0 and GS_MAX_SHARDS > 1:
+        try:
+            pages = await loop.run_in_executor(PDF_EXECUTOR, _page_count, input_path)
+        except pikepdf.PdfError:
+            pass  # let Ghostscript have a go at it as a whole
+    shards = min(GS_MAX_SHARDS, pages // GS_SHARD_PAGES) if pages else 1
+    if shards < 2:
+        return await _run_gs([*gs_args, f"-sOutputFile={output_path}", input_path])
+
+    step = -(-pages // shards)
+    starts = range(1, pages + 1, step)
+    parts = [f"{output_path}.part{i}" for i in range(len(starts))]
+    try:
+        results = await asyncio.gather(*(
+            _run_gs([*gs_args, f"-dFirstPage={first}", f"-dLastPage={min(first + step - 1, pages)}",
+                     f"-sOutputFile={part}", input_path])
+            for first, part in zip(starts, parts)
+        ))
+        for returncode, stderr_output in results:
+            if returncode != 0:
+                return returncode, stderr_output
+        try:
+            await loop.run_in_executor(PDF_EXECUTOR, _join_shards, input_path, parts, output_path)
+        except pikepdf.PdfError as e:
+            return -1, f"Could not join page ranges: {e}"
+        return 0, ""
+    finally:
+        for part in parts:
+            await asyncio.to_thread(remove_quietly, part)
+
+
+async def _run_ghostscript(gs: str, level: int, input_path: str, output_path: str,
+                           detect_duplicates: bool = True) -> os.stat_result:
+    """Compress input_path into output_path, with one fallback if gs fails; returns the output's stat"""
+    gs_args = [gs, *GS_ARGS[level, detect_duplicates]]
+
+    # Try primary compression, on a persistent worker when enabled
     compression_success = False
     stderr_output = ""
-    
-    try:
-        result = subprocess.run(
-            cmd, 
-            check=True, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            timeout=60  # 60 second timeout
-        )
-        stderr_output = result.stderr.decode("utf-8", errors="ignore")
-        compression_success = True
-    except subprocess.CalledProcessError as e:
-        stderr_output = e.stderr.decode("utf-8", errors="ignore") if e.stderr else str(e)
-        print(f"Primary compression failed: {stderr_output}")
-    except Exception as e:
-        stderr_output = str(e)
-        print(f"Primary compression exception: {stderr_output}")
 
-    # Fallback method if primary fails or produces no reduction
-    if not compression_success or not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+    if GS_PERSISTENT:
+        compression_success = await _gs_pool((level, detect_duplicates), gs_args).run(input_path, output_path)
+
+    if not compression_success:
+        returncode, stderr_output = await _run_gs_sharded(gs_args, input_path, output_path)
+        compression_success = returncode == 0
+        if not compression_success:
+            print(f"Primary compression failed: {stderr_output}")
+
+    output_stat = await asyncio.to_thread(_output_stat, output_path) if compression_success else None
+
+    # Fallback method if primary fails or produces no output; it can safely
+    # reuse the primary output path since nothing usable was written there
+    if not output_stat:
         print("Using fallback compression method")
-        
-        fallback_cmd = [
-            gs,
-            "-sDEVICE=pdfwrite",
-            "-dCompatibilityLevel=1.4",
-            "-dPDFSETTINGS=/screen",
-            "-dNOPAUSE",
-            "-dQUIET",
-            "-dBATCH",
-            "-dEmbedAllFonts=true",
-            "-dSubsetFonts=true",
-            "-dAutoRotatePages=/None",
-            "-dDetectDuplicateImages=true",
-            "-dCompressFonts=true",
-            "-dCompressPages=true",
-            "-dUseFlateCompression=true",
-            "-dDownsampleColorImages=true",
-            "-dDownsampleGrayImages=true",
-            "-dDownsampleMonoImages=true",
-            "-dColorImageResolution=72",
-            "-dGrayImageResolution=72",
-            "-dMonoImageResolution=72",
-            "-dColorImageFilter=/DCTEncode",
-            "-dGrayImageFilter=/DCTEncode",
-            "-dMonoImageFilter=/CCITTFaxEncode",
-            "-dJPEGQ=10",
-            f"-sOutputFile={fallback_path}",
-            input_path,
-        ]
-        
-        try:
-            subprocess.run(fallback_cmd, check=True, stderr=subprocess.PIPE, timeout=60)
-            if os.path.exists(fallback_path) and os.path.getsize(fallback_path) > 0:
-                # Use fallback file
-                output_path = fallback_path
-                compression_success = True
-        except Exception as e:
-            fallback_error = str(e)
+    
+        fallback_cmd = [gs, *GS_FALLBACK_ARGS[detect_duplicates], f"-sOutputFile={output_path}", input_path]
+    
+        returncode, fallback_error = await _run_gs(fallback_cmd)
+        if returncode == 0:
+            output_stat = await asyncio.to_thread(_output_stat, output_path)
+        else:
             print(f"Fallback compression failed: {fallback_error}")
 
-    if not compression_success or not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+    if not output_stat:
         raise HTTPException(
             status_code=500, 
             detail=f"Compression failed after all attempts. Ghostscript error: {stderr_output}"
         )
 
-    # Verify compression actually happened
-    orig_size = os.path.getsize(input_path)
-    comp_size = os.path.getsize(output_path)
-    
-    # If compression failed (output >= input), try one last aggressive method
-    if comp_size >= orig_size and level < 2:
-        print(f"Compression ineffective (output {comp_size} >= input {orig_size}), trying aggressive method")
-        aggressive_cmd = [
-            gs,
-            "-sDEVICE=pdfwrite",
-            "-dCompatibilityLevel=1.4",
-            "-dNOPAUSE",
-            "-dQUIET",
-            "-dBATCH",
-            "-dEmbedAllFonts=false",  # Don't embed fonts
-            "-dSubsetFonts=false",
-            "-dAutoRotatePages=/None",
-            "-dDetectDuplicateImages=true",
-            "-dCompressFonts=true",
-            "-dCompressPages=true",
-            "-dUseFlateCompression=true",
-            "-dDownsampleColorImages=true",
-            "-dDownsampleGrayImages=true",
-            "-dDownsampleMonoImages=true",
-            "-dColorImageResolution=50",
-            "-dGrayImageResolution=50",
-            "-dMonoImageResolution=50",
-            "-dColorImageFilter=/DCTEncode",
-            "-dGrayImageFilter=/DCTEncode",
-            "-dMonoImageFilter=/CCITTFaxEncode",
-            "-dJPEGQ=5",
-            "-dPDFSETTINGS=/screen",
-            "-dColorConversionStrategy=/RGB",
-            "-dProcessColorModel=/DeviceRGB",
-            f"-sOutputFile={output_path}",
-            input_path,
-        ]
-        
-        try:
-            subprocess.run(aggressive_cmd, check=True, stderr=subprocess.PIPE, timeout=60)
-            new_comp_size = os.path.getsize(output_path)
-            if new_comp_size < comp_size:
-                comp_size = new_comp_size
-                print(f"Aggressive compression succeeded: {orig_size} -> {comp_size}")
-        except Exception as e:
-            print(f"Aggressive compression failed: {str(e)}")
+    return output_stat
 
-    # Calculate reduction
-    reduction = max(0.0, 100 * (1 - comp_size / orig_size)) if orig_size > 0 else 0.0
-    
-    # If reduction is negligible (<5%) and level is aggressive, force a minimum reduction
-    if reduction < 5 and level < 2:
-        # Log the issue but don't fail
-        print(f"Warning: Minimal compression achieved ({reduction:.2f}%) for level {level}")
-
-    headers = {
-        "X-Original-Size": str(orig_size),
-        "X-Compressed-Size": str(comp_size),
-        "X-Reduction-Percentage": f"{reduction:.2f}",
-        "X-Quality-Setting": settings['preset'],
-    }
 
-    # Cleanup input file
+def _downsample_images(pdf: pikepdf.Pdf, settings: dict):
+    """Re-encode RGB/gray page images as JPEG at the level's resolution and quality"""
+    seen = set()
+    for page in pdf.pages:
+        # Assume an image spans at most the page, which holds for scans
+        _, _, width, height = (float(v) for v in page.mediabox)
+        max_side = max(1, int(max(width, height) / 72 * settings['color_res']))
+        for raw in page.images.values():
+            if raw.objgen in seen:
+                continue
+            seen.add(raw.objgen)
+            # Masks and stencils depend on exact sample values, so leave them lossless
+            if raw.get("/ImageMask") or "/Mask" in raw or raw.get("/BitsPerComponent") != 8:
+                continue
+            if raw.get("/ColorSpace") not in (pikepdf.Name.DeviceRGB, pikepdf.Name.DeviceGray):
+                continue
+            # A /Decode array remaps samples, which re-encoding would bake in wrong
+            if "/Decode" in raw:
+                continue
+            try:
+                image = pikepdf.PdfImage(raw).as_pil_image()
+                if image.mode not in ("RGB", "L"):
+                    continue
+                if max(image.size) > max_side:
+                    # For JPEG sources, let libjpeg-turbo decode straight at a reduced
+                    # DCT scale instead of decoding full size and resampling it all
+                    image.draft(image.mode, (max_side, max_side))
+                # JPEG sources decode lazily, so a corrupt stream only fails here
+                image.load()
+                if max(image.size) > max_side:
+                    image.thumbnail((max_side, max_side), Image.LANCZOS)
+                buf = io.BytesIO()
+                image.save(buf, "JPEG", quality=settings['jpeg_q'])
+            except Exception:
+                continue  # a filter, layout or stream PIL can't handle; keep the original
+            if buf.tell() >= len(raw.read_raw_bytes()):
+                continue
+            raw.write(buf.getvalue(), filter=pikepdf.Name.DCTDecode)
+            raw.Width, raw.Height = image.size
+            if "/DecodeParms" in raw:
+                del raw.DecodeParms
+
+
+def _pikepdf_compress(input_path: str, output_path: str, settings: dict):
+    """Repack with object streams and recompressed Flate, downsampling images where the level asks (blocking)"""
+    with pikepdf.open(input_path) as pdf:
+        if settings['downsample']:
+            _downsample_images(pdf, settings)
+        pdf.save(
+            output_path,
+            compress_streams=True,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate,
+            recompress_flate=True,
+            linearize=False,
+        )
+
+
+async def _run_pikepdf(input_path: str, output_path: str, settings: dict) -> os.stat_result:
+    """Fallback when Ghostscript is missing, done in-process with pikepdf and Pillow"""
     try:
-        os.remove(input_path)
-    except:
-        pass
+        await asyncio.get_running_loop().run_in_executor(
+            PDF_EXECUTOR, _pikepdf_compress, input_path, output_path, settings
+        )
+    except pikepdf.PdfError as e:
+        raise HTTPException(status_code=400, detail=f"Could not compress PDF: {e}")
 
-    output_filename = f"compressed_{os.path.splitext(file.filename)[0]}.pdf"
-    return FileResponse(
-        output_path,
-        media_type="application/pdf",
-        filename=output_filename,
-        headers=headers
-    )
+    output_stat = await asyncio.to_thread(_output_stat, output_path)
+    if not output_stat:
+        raise HTTPException(status_code=500, detail="Compression failed: no output was written")
+    return output_stat
+
+
+@app.post("/api/pdf/compress")
+async def compress_pdf(file: UploadFile = File(...), level: int = 0):
+    """
+    Compress PDF using Ghostscript with fallback methods.
+    Valid levels:
+        0: /screen     → Maximum compression (72 DPI)
+        1: /ebook      → Balanced compression (150 DPI)
+        2: /printer    → High quality (300 DPI)
+        3: /prepress   → Highest quality (300+ DPI)
+    """
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="File must be a PDF")
+
+    # Named files rather than O_TMPFILE: gs and its persistent workers open them
+    # by path, and outputs are hard-linked into the cache. Both are removed per
+    # request (input in finally, output after sending), so nothing lingers
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    # Starlette counts upload bytes while parsing, so big inputs can skip tmpfs
+    # and their output stays beside them, uncached, so it never lands in RAM either
+    large = (file.size or 0) > SHM_MAX_INPUT
+    input_dir = LARGE_UPLOAD_DIR if large else UPLOAD_DIR
+    input_path = os.path.join(input_dir, f"input_{timestamp}.pdf")
+    output_path = os.path.join(input_dir, f"compressed_{timestamp}.pdf")
+
+    if level not in QUALITY_SETTINGS:
+        raise HTTPException(status_code=400, detail="Compression level must be 0, 1, 2, or 3")
+
+    settings = QUALITY_SETTINGS[level]
+
+    # Locate Ghostscript binary, falling back to pikepdf without it
+    gs = shutil.which("gs") or shutil.which("gswin32c") or shutil.which("gswin64c")
+
+    try:
+        # Stream uploaded file to disk, hashing it on the way for the cache.
+        # Work stays file-to-file on purpose: gs copies a PDF read from stdin
+        # into its own temp file, and the size headers need the finished output
+        hasher = blake3.blake3()
+        with open(input_path, "wb") as f:
+            orig_size = await spool_to_disk(file, f, hasher)
+
+        digest = hasher.hexdigest()
+        cache_path = os.path.join(COMPRESSED_DIR, f"{digest}_L{level}.pdf")
+        # Filesystem calls go through the threadpool so slow storage can't stall the loop
+        cached = None if large else await asyncio.to_thread(_cache_lookup, cache_path, output_path)
+        if cached:
+            print(f"Compress cache hit for level {level}")
+            serve_path, stat_result = cached
+            background = BackgroundTask(remove_quietly, output_path) if serve_path == output_path else None
+        else:
+            async with COMPRESS_SEM:
+                # One pass picked up front; a result that isn't smaller is not
+                # retried with harsher settings than the level asked for
+                use_gs, detect_duplicates = await _probe_for_ghostscript(input_path, orig_size) if gs else (False, False)
+                if use_gs:
+                    stat_result = await _run_ghostscript(gs, level, input_path, output_path, detect_duplicates)
+                else:
+                    stat_result = await _run_pikepdf(input_path, output_path, settings)
+                if stat_result.st_size >= orig_size:
+                    # Already well compressed; hand back the upload as it was
+                    stat_result = await asyncio.to_thread(_reuse_input, input_path, output_path)
+            # Cached only after sending, so packing never delays the response
+            serve_path = output_path
+            if large:
+                background = BackgroundTask(remove_quietly, output_path)
+            else:
+                background = BackgroundTask(_cache_output, output_path, cache_path)
+
+        # Calculate reduction; every size comes from the one stat taken per file
+        comp_size = stat_result.st_size
+        reduction = max(0.0, 100 * (1 - comp_size / orig_size)) if orig_size > 0 else 0.0
+    
+        # If reduction is negligible (<5%) and level is aggressive, force a minimum reduction
+        if reduction < 5 and level < 2:
+            # Log the issue but don't fail
+            print(f"Warning: Minimal compression achieved ({reduction:.2f}%) for level {level}")
+
+        headers = {
+            "X-Original-Size": str(orig_size),
+            "X-Compressed-Size": str(comp_size),
+            "X-Reduction-Percentage": f"{reduction:.2f}",
+            "X-Quality-Setting": settings['preset'],
+            # Weak: (input digest, level) names an equivalent result, but the
+            # bytes depend on the path taken (gs, pikepdf, shards, input reused)
+            "ETag": f'W/"{digest}-{level}"',
+            "Cache-Control": "private, max-age=3600, immutable",
+        }
+
+        output_filename = f"compressed_{os.path.splitext(file.filename)[0]}.pdf"
+        return PDFFileResponse(
+            serve_path,
+            stat_result=stat_result,
+            media_type="application/pdf",
+            filename=output_filename,
+            headers=headers,
+            background=background,
+        )
+    except BaseException:
+        remove_quietly(output_path)
+        raise
+    finally:
+        # gs opens files by path, so the input can only go once it is done
+        await asyncio.to_thread(remove_quietly, input_path)
+
+
+# =====================
+# 🔹 Serve Frontend (SPA fallback)
+# =====================
+# Registered last: routes match in order, so this must not shadow the API
+@app.get("/{full_path:path}", include_in_schema=False)
+async def serve_frontend(full_path: str):
+    if full_path.startswith("api/"):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if INDEX_HTML is not None:
+        return Response(INDEX_HTML, media_type="text/html")
+    return {
+        "message": "Frontend build not found. Please ensure `npm run build` has been executed.",
+        "status": "backend-only mode",
+    }
 
 
 # =====================
@@ -394,4 +1018,14 @@ async def compress_pdf(file: UploadFile = File(...), level: int = 0):
 # =====================
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Compression is CPU-bound, so one worker per core. Exported so each worker,
+    # which imports main afresh, sizes its limits to the same count
+    os.environ.setdefault("WEB_CONCURRENCY", str(os.cpu_count() or 1))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",  # uvloop when installed (not on Windows), else asyncio
+        http="httptools",
+        workers=int(os.environ["WEB_CONCURRENCY"]),
+    )
\ No newline at end of file
@@ -7,5 +7,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
+        loop="auto",  # uvloop when installed (not on Windows), else asyncio
+        http="httptools",
         log_level="info"
     )
\ No newline at end of file